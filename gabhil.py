@@ -1,14 +1,22 @@
 from dataclasses import field, dataclass
 from collections import defaultdict
-from itertools import groupby
+from itertools import islice
+from functools import lru_cache
 from datetime import datetime
 import imaplib
 import email
-from bs4 import BeautifulSoup
+import email.policy
+import base64
+import quopri
+import re
+import queue
+import threading
+import lxml.html
+from lxml import etree
 from sanitize_filename import sanitize
 
 # Class with options to alter the behaviour
-@dataclass
+@dataclass(slots=True)
 class Config:
     include_metadata: bool = True     # If true, include a first block with metadata
     append_file: bool = False         # If true, append instead of overwriting
@@ -18,10 +26,11 @@ class Config:
     color_map: dict = field(default_factory=dict)  # Maps between colors and icons
     join_titles: bool = True          # If a color is replaced by a heading mark, join with spaces all lines in that highlight
     dump_stdout: bool = False         # Dump to stdout instead of file
-    html_parser: str = "html.parser"  # It can be lxml if the library is installed
+    html_parser: str = "lxml"         # Unused (lxml is always used), kept for old config files
+    fetch_batch_size: int = 100       # Number of emails retrieved with a single IMAP FETCH command
 
 # Class with email configuration parameters
-@dataclass
+@dataclass(slots=True)
 class EmailConfig:
     login: str
     server: str
@@ -29,7 +38,7 @@ class EmailConfig:
     subject: str  # This has to be set to the string which Apple Books sends in the subject of the email
 
 # Class to store each annotation
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Annotation:
     date: str
     chapter: str
@@ -38,13 +47,118 @@ class Annotation:
     note: str
 
 # Class to store the metadata
-@dataclass
+@dataclass(slots=True)
 class MetaData:
     title: str = "Untitled"
     author: str = "Unkown"
     source: str = "Unspecified"
     imported: datetime = field(default_factory=lambda: datetime.now())
 
+# Prefixes in color_map which turn a highlight into a heading
+_HEADING_PREFIXES = frozenset(("#", "##", "###", "####"))
+
+# Precompiled XPath expressions to locate the relevant parts of the HTML
+# which Apple Books attaches to the email
+def _xpath_for_class(cls):
+    return etree.XPath(f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')]")
+
+_XP_ANNOT = _xpath_for_class("annotation")
+_XP_CITATION = _xpath_for_class("citation")
+_XP_CLASSED = etree.XPath(".//*[@class]")   # All descendants with a class attribute
+
+# Class name which is present in every annotation. If the raw html does
+# not contain it, there is no need to parse it
+_ANNOT_MARKER = b"annotationselectionMarker"
+
+@lru_cache
+def _html_parser(charset: str):
+    """Returns a lxml parser for html bytes in the given charset (the one
+    declared in the email, which takes precedence over any declaration
+    inside the html).
+    Comments and processing instructions are never looked at, so no nodes
+    are built for them, and neither is the table of ids"""
+    options = dict(remove_comments=True, remove_pis=True, collect_ids=False)
+    try:
+        return lxml.html.HTMLParser(encoding=charset, **options)
+    except LookupError:
+        return lxml.html.HTMLParser(encoding="utf-8", **options)
+
+# Helpers to find and decode the html part of an email from its IMAP
+# BODYSTRUCTURE, so that only that part has to be downloaded
+_IMAP_TOKEN_RE = re.compile(rb'\(|\)|"((?:[^"\\]|\\.)*)"|[^\s()"]+')
+
+def _parse_imap_response(data) -> list:
+    r"""Parses the data returned by imaplib for a FETCH command into nested
+    lists. Atoms and strings are returned as str and NIL as None. The literals,
+    which imaplib returns as the second element of a tuple, are also
+    returned as str
+
+    >>> _parse_imap_response([b'1 (UID 4 BODYSTRUCTURE ("TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "BASE64" 10 1 NIL NIL NIL))'])
+    ['1', ['UID', '4', 'BODYSTRUCTURE', ['TEXT', 'HTML', ['CHARSET', 'UTF-8'], None, None, 'BASE64', '10', '1', None, None, None]]]
+    >>> _parse_imap_response([(b'2 (BODYSTRUCTURE ("TEXT" "HTML" NIL NIL {7}', b'a "b" c'), b' "7BIT" 3 1))'])
+    ['2', ['BODYSTRUCTURE', ['TEXT', 'HTML', None, None, 'a "b" c', '7BIT', '3', '1']]]
+    >>> _parse_imap_response([b'3 (FLAGS (\\Seen "x\\"y"))'])
+    ['3', ['FLAGS', ['\\Seen', 'x"y']]]
+    """
+    stack = [[]]
+    for part in data:
+        if isinstance(part, tuple):
+            text, literal = part[0][:part[0].rindex(b"{")], part[1]
+        else:
+            text, literal = part, None
+        for m in _IMAP_TOKEN_RE.finditer(text):
+            token = m.group()
+            if token == b"(":
+                stack.append([])
+            elif token == b")":
+                closed = stack.pop()
+                stack[-1].append(closed)
+            elif m.group(1) is not None:
+                stack[-1].append(re.sub(rb"\\(.)", rb"\1", m.group(1)).decode(errors="replace"))
+            else:
+                stack[-1].append(None if token.upper() == b"NIL" else token.decode())
+        if literal is not None:
+            stack[-1].append(literal.decode(errors="replace"))
+    return stack[0]
+
+def _find_html_part(structure, section=""):
+    """Walks a BODYSTRUCTURE looking for the text/html part. Returns a
+    tuple (section, encoding, charset) or None if there is no such part
+
+    >>> plain = ["TEXT", "PLAIN", ["CHARSET", "us-ascii"], None, None, "7BIT", "10", "1"]
+    >>> html = ["TEXT", "HTML", ["charset", "iso-8859-1"], None, None, "quoted-printable", "99", "3"]
+    >>> image = ["IMAGE", "PNG", ["NAME", "x.png"], None, None, "BASE64", "500"]
+    >>> _find_html_part([[plain, html, "ALTERNATIVE", ["BOUNDARY", "b1"]], image, "MIXED"])
+    ('1.2', 'QUOTED-PRINTABLE', 'iso-8859-1')
+    >>> _find_html_part(["TEXT", "HTML", None, None, None, None, "99", "3"])
+    ('1', '7BIT', 'utf-8')
+    >>> _find_html_part([plain, image, "MIXED", None]) is None
+    True
+    """
+    if isinstance(structure[0], list):
+        # Multipart: the subparts come first, followed by the subtype
+        for i, subpart in enumerate(structure, start=1):
+            if not isinstance(subpart, list):
+                break
+            found = _find_html_part(subpart, f"{section}.{i}" if section else str(i))
+            if found:
+                return found
+        return None
+    maintype, subtype, params, _, _, encoding = structure[:6]
+    if (maintype.lower(), subtype.lower()) != ("text", "html"):
+        return None
+    params = dict(zip(params[::2], params[1::2])) if params else {}
+    charset = next((v for k, v in params.items() if k.lower() == "charset"), "utf-8")
+    return section or "1", (encoding or "7BIT").upper(), charset
+
+def _decode_html_part(payload: bytes, encoding: str) -> bytes:
+    """Undoes the Content-Transfer-Encoding of a part"""
+    if encoding == "BASE64":
+        return base64.b64decode(payload)
+    elif encoding == "QUOTED-PRINTABLE":
+        return quopri.decodestring(payload)
+    return payload
+
 
 # Main class which does all the job
 class AnnotationExtractor:
@@ -52,64 +166,82 @@ class AnnotationExtractor:
         self.email_cfg = email_cfg
         self.cfg = cfg
         self.mail_connection = None
+        self._fresh_connection = False  # True until process_emails first uses the connection
+        # Lookups used for every annotation, computed only once
+        self._color_get = cfg.color_map.get
+        self._heading_colors = {c for c, p in cfg.color_map.items() if p in _HEADING_PREFIXES}
+        note_icon = cfg.color_map.get("note", "")
+        self._note_icon = f"{note_icon} " if note_icon else ""
 
     @staticmethod
     def _extract_annotation(e) -> Annotation:
         """Extracts relevant info from html element for a single annotation"""
-        date = e.find(class_="annotationdate").text.strip()
-        chapter = e.find(class_="annotationchapter").text.strip()
-        color = e.find(class_="annotationselectionMarker").attrs["class"][-1]
-        text = e.find(class_="annotationrepresentativetext").text.strip()
-        note = e.find(class_="annotationnote").text.strip()
+        # Walk the descendants only once, binning them by class name
+        # (the first element found for each class wins)
+        by_class = {}
+        for child in _XP_CLASSED(e):
+            for cls in child.get("class").split():
+                by_class.setdefault(cls, child)
+        date = by_class["annotationdate"].text_content().strip()
+        chapter = by_class["annotationchapter"].text_content().strip()
+        color = by_class["annotationselectionMarker"].get("class").split()[-1]
+        text = by_class["annotationrepresentativetext"].text_content().strip()
+        note = by_class["annotationnote"].text_content().strip()
         return Annotation(date, chapter, color, text, note)
 
     def _format_annotation(self, a, indent=""):
         """Receives a single annotation and returns a formatted string,
         ready to be dumped in the markdown file"""
-        prefix = self.cfg.color_map.get(a.color, "")
-        if prefix in ("#", "##", "###", "####") and self.cfg.join_titles:
-            a.text = " ".join(a.text.split())
+        prefix = self._color_get(a.color, "")
+        text = a.text
+        if a.color in self._heading_colors and self.cfg.join_titles:
+            text = " ".join(text.split())
         if prefix:
             prefix += " "
-        fmtd = f"{indent}- {prefix}{a.text}"
+        # The first line is assembled from pieces, and the note (if any) is a second line
+        line = [f"{indent}- {prefix}{text}"]
         if self.cfg.include_chapter_in_notes:
-            fmtd += f" (Chapter '{a.chapter}')"
+            line.append(f" (Chapter '{a.chapter}')")
         if self.cfg.include_date_in_notes:
-            fmtd += f"({a.date})"
+            line.append(f"({a.date})")
+        lines = ["".join(line)]
         if a.note:
-            note_icon = self.cfg.color_map.get("note", "")
-            if note_icon:
-                note_icon+=" "
-            fmtd += f"\n{indent}    - {note_icon}{a.note}"
-        return fmtd
+            lines.append(f"{indent}    - {self._note_icon}{a.note}")
+        return "\n".join(lines)
 
-    def _extract_annotations_from_html(self, html):
-        """Receives the HTML wihch is attached in the email and scrapes
-        it to extract all anotations and metainfo.
+    def _extract_annotations_from_html(self, html: bytes, charset="utf-8"):
+        """Receives the HTML wihch is attached in the email (as bytes in
+        the given charset) and scrapes it to extract all anotations and metainfo.
 
         Returns a tuple with two objects: Metadata and a list of Annotation objects
         """
         def extract_if_not_none(elem) -> str:
-            if elem:
-                return elem.text.strip()
+            if elem is not None:
+                return elem.text_content().strip()
             else:
                 return "Not specified"
 
-        soup = BeautifulSoup(html, features=self.cfg.html_parser)
-        result = []
+        # Emails which are not from Apple Books are not even parsed
+        if _ANNOT_MARKER not in html:
+            return MetaData(), []
+        root = lxml.html.document_fromstring(html, parser=_html_parser(charset))
         # Extract annotations
-        for _, e in enumerate(soup.find_all(class_="annotation")):
-            result.append(self._extract_annotation(e))
+        result = [self._extract_annotation(e) for e in _XP_ANNOT(root)]
 
-        # Extract book title and author
-        title = extract_if_not_none(soup.h1)
-        author = extract_if_not_none(soup.h2)
-        ref = extract_if_not_none(soup.find(class_="citation"))
+        # Extract book title and author (always needed, since they give
+        # the name of the file)
+        title = extract_if_not_none(root.find(".//h1"))
+        author = extract_if_not_none(root.find(".//h2"))
+        if not self.cfg.include_metadata:
+            # The source is only shown in the metadata block
+            return MetaData(title=title, author=author), result
+        citation = _XP_CITATION(root)
+        ref = extract_if_not_none(citation[0] if citation else None)
         if ref!="Not specified":
             ref = ref.split("\n")[0].strip()
         return MetaData(title=title, author=author, source=ref), result
 
-    def group_and_dump(self, group_keys, annotations, indent):
+    def group_and_dump(self, group_keys, annotations, indent, level=0, keys=None, indices=None):
         """Groups the list of annotatios for the first
         field in the list group_keys, and dumps a header for the group
         followed by the the result of calling recursively itself
@@ -118,27 +250,36 @@ class AnnotationExtractor:
         If there is no field to group on, or if the field is invalid,
         the list of annotations is dumped, stopping the recursive calls
 
+        level is the nesting depth of the recursion, which sets the
+        heading size of the group headers.
+
+        The first call reads the values of all group keys into lists (keys),
+        so that the attributes of each annotation are looked up only once.
+        The recursive calls then work with lists of positions (indices)
+        in annotations.
+
         It returns the list of lines produced
         """
+        if keys is None:
+            keys = {k: [getattr(a, k) for a in annotations]
+                    for k in set(group_keys) if hasattr(annotations[0], k)}
+            indices = range(len(annotations))
         lines = []
-        if not group_keys or not hasattr(annotations[0], group_keys[0]):
-            group_key = None
-        else:
-            group_key = group_keys[0]
-        groups = {}
-        if group_key is None:
-            return [self._format_annotation(annotation, indent=indent) for annotation in annotations]
-
-        # Grouping has to be performed, so we first sort and group by that key
-        key = lambda e: getattr(e, group_key)
-        for k, g in groupby(sorted(annotations, key=key), key=key):
-            groups[k] = list(g)
+        if not group_keys or group_keys[0] not in keys:
+            return [self._format_annotation(annotations[i], indent=indent) for i in indices]
+
+        # Grouping has to be performed. It is done in a single pass, so the
+        # groups keep the order in which they appear in the email
+        values = keys[group_keys[0]]
+        groups = defaultdict(list)
+        for i in indices:
+            groups[values[i]].append(i)
         # And then dump the result (recursively)
-        for group, annotations in groups.items():
-            level = len(indent)//4
-            header = "#"*(level+1)
+        header = "#"*(level+1)
+        for group, group_indices in groups.items():
             lines.append(f"{indent}- {header} {group}")
-            lines.extend(self.group_and_dump(group_keys[1:], annotations, indent+"    "))
+            lines.extend(self.group_and_dump(group_keys[1:], annotations, indent+"    ",
+                                             level+1, keys, group_indices))
         return lines
 
     def generate_markdown(self, metadata, annotations):
@@ -158,26 +299,171 @@ class AnnotationExtractor:
         lines.extend(self.group_and_dump(group_keys, annotations, indent=""))
         return "\n".join(lines)
 
-    def extract_html_from_email(self, id_:str) -> str:
-        """ This function retrieves a single email and extracts the html part"""
+    @staticmethod
+    def _extract_html_from_message(raw_message: bytes) -> tuple:
+        """Extracts the html part of a raw email. Returns a tuple with
+        the html (as bytes) and its charset"""
+        msg = email.message_from_bytes(raw_message, policy=email.policy.default)
+        return AnnotationExtractor._html_body(msg)
+
+    @staticmethod
+    def _html_body(msg) -> tuple:
+        """Returns the html body of an EmailMessage and its charset, looking
+        also into attached emails (the notes could have been forwarded)"""
+        html_part = msg.get_body(preferencelist=('html',))
+        if html_part is not None:
+            return html_part.get_payload(decode=True), html_part.get_content_charset() or "utf-8"
+        for attachment in msg.iter_attachments():
+            if attachment.get_content_type() == "message/rfc822":
+                html, charset = AnnotationExtractor._html_body(attachment.get_content())
+                if html:
+                    return html, charset
+        return b"", "utf-8"
+
+    def _fetch_html_from_emails(self, id_list):
+        """Generator which retrieves the emails in id_list and yields the
+        html part of each one, as a tuple (html bytes, charset). Instead of
+        one round-trip per email, the emails are fetched in batches of
+        cfg.fetch_batch_size.
+
+        Only the html part is downloaded: the BODYSTRUCTURE of the emails
+        tells which section contains it. Emails whose html is not a part of
+        their own (e.g: notes forwarded as an attached email) are downloaded
+        completely. BODY.PEEK is used so that the emails are not marked as seen
+        """
+        ids = iter(id_list)
+        while batch := list(islice(ids, self.cfg.fetch_batch_size)):
+            _, data = self.mail_connection.fetch(",".join(batch), '(BODYSTRUCTURE)')
+            response = _parse_imap_response(data)
+            # The response alternates message ids and lists of (name, value) items.
+            # The server can mix in unsolicited FETCH responses (e.g: FLAGS
+            # changed by another client), which don't carry a BODYSTRUCTURE
+            html_parts = {}
+            for id_, items in zip(response[::2], response[1::2]):
+                fields = dict(zip(items[::2], items[1::2]))
+                if fields.get("BODYSTRUCTURE") is not None:
+                    html_parts[id_] = _find_html_part(fields["BODYSTRUCTURE"])
+
+            # Emails with the html part in the same section are fetched together
+            by_section = defaultdict(list)
+            for id_ in batch:
+                part = html_parts.get(id_)
+                by_section[part[0] if part else ""].append(id_)
+
+            htmls = {}
+            for section, ids_in_section in by_section.items():
+                _, data = self.mail_connection.fetch(",".join(ids_in_section), f'(BODY.PEEK[{section}])')
+                # Each email comes as a tuple (header line, contents),
+                # followed by a closing b')' which we skip (as well as
+                # any unsolicited response for other emails)
+                for response_part in data:
+                    if not isinstance(response_part, tuple):
+                        continue
+                    id_ = response_part[0].split()[0].decode()
+                    if id_ not in ids_in_section:
+                        continue
+                    if section:
+                        _, encoding, charset = html_parts[id_]
+                        htmls[id_] = _decode_html_part(response_part[1], encoding), charset
+                    else:
+                        htmls[id_] = self._extract_html_from_message(response_part[1])
+            for id_ in batch:
+                yield htmls.get(id_, (b"", "utf-8"))
+
+    def _fetch_html_in_background(self, id_list):
+        """Generator which yields the same as _fetch_html_from_emails, but
+        runs it in a separate thread, so that the next emails are downloaded
+        while the current one is parsed. Only that thread uses the IMAP
+        connection, since imaplib is not thread-safe.
+
+        The thread is always stopped and joined before this generator ends,
+        also when the consumer stops early (on an exception or when closing
+        the generator), so the connection is free to be used again afterwards"""
+        htmls = queue.Queue(maxsize=4)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            # Waits for room in the queue, unless the consumer has gone away
+            while not stop.is_set():
+                try:
+                    htmls.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            try:
+                for html in self._fetch_html_from_emails(id_list):
+                    if not put(html):
+                        return
+            except Exception as e:
+                put(e)
+            else:
+                put(None)  # No more emails
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while (html := htmls.get()) is not None:
+                if isinstance(html, Exception):
+                    raise html
+                yield html
+        finally:
+            stop.set()
+            thread.join()
+
+    def extract_html_from_email(self, id_:str) -> tuple:
+        """ This function retrieves a single email and extracts the html part.
+        Returns a tuple with the html (as bytes) and its charset"""
         if self.mail_connection is None:
-            return ""
-        _, data = self.mail_connection.fetch(id_,'(RFC822)')
-        html = ""
-        for response_part in data :
-            if not isinstance(response_part,tuple):
-                continue
-            msg = email.message_from_bytes(response_part[1])
-            for _, part in enumerate(msg.walk()):
-                if part.get_content_subtype() == 'html':
-                    html = part.get_payload(decode=True)
-                    break
-            return html
+            return b"", "utf-8"
+        return next(self._fetch_html_from_emails([id_]), (b"", "utf-8"))
+
+    def __enter__(self):
+        self._imap_connect()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._imap_logout()
+
+    def _imap_logout(self):
+        if self.mail_connection is not None:
+            try:
+                self.mail_connection.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass  # The connection was already dead
+            self.mail_connection = None
 
     def _imap_connect(self):
-        self.mail_connection = imaplib.IMAP4_SSL(self.email_cfg.server)
-        self.mail_connection.login(self.email_cfg.login, self.email_cfg.passwd)
-        self.mail_connection.select('inbox')
+        """Connects to the mail server and selects the inbox. An open
+        connection is reused, so repeated calls to process_emails (e.g: when
+        polling) don't repeat the TLS handshake, LOGIN and SELECT"""
+        if self.mail_connection is not None and not self._fresh_connection:
+            # The server may have dropped the connection while it was idle
+            # since the last process_emails (a just opened one is not checked)
+            try:
+                self.mail_connection.noop()
+            except (imaplib.IMAP4.abort, OSError):
+                self._imap_logout()
+        if self.mail_connection is None:
+            self.mail_connection = imaplib.IMAP4_SSL(self.email_cfg.server)
+            self.mail_connection.login(self.email_cfg.login, self.email_cfg.passwd)
+            self._fresh_connection = True
+            # Allows non-ascii subjects in the search. The capabilities are
+            # requested once after login, since servers often advertise
+            # ENABLE and UTF8=ACCEPT only to authenticated clients
+            # (imaplib.enable() checks the list stored in the connection)
+            _, data = self.mail_connection.capability()
+            self.mail_connection.capabilities = tuple(data[0].decode().upper().split())
+            capabilities = self.mail_connection.capabilities
+            if "ENABLE" in capabilities and "UTF8=ACCEPT" in capabilities:
+                try:
+                    self.mail_connection.enable("UTF8=ACCEPT")
+                except imaplib.IMAP4.error:
+                    pass  # Only non-ascii subjects are affected
+        if self.mail_connection.state != "SELECTED":
+            self.mail_connection.select('inbox')
 
     def process_emails(self):
         """This function connects to the mail server, searches all emails
@@ -185,10 +471,11 @@ class AnnotationExtractor:
         each one (after extracting the annotations)"""
 
         self._imap_connect()
+        self._fresh_connection = False
         if "gmail" in self.email_cfg.server:
-            _, data = self.mail_connection.search(None, 'X-GM-RAW', f'"{e_cfg.subject}"')
+            _, data = self.mail_connection.search(None, 'X-GM-RAW', f'"{self.email_cfg.subject}"')
         else:
-            _, data = self.mail_connection.uid('search', "", f'(SUBJECT "{e_cfg.subject}")')
+            _, data = self.mail_connection.uid('search', "", f'(SUBJECT "{self.email_cfg.subject}")')
 
         mail_ids=data[0].decode()
         id_list=mail_ids.split()
@@ -196,9 +483,8 @@ class AnnotationExtractor:
             print(f"You don't have any email in your inbox whose subject contains {self.email_cfg.subject!r}")
             print("You may need to change that string in the configuration file")
             return
-        for id_ in id_list:
-            html = self.extract_html_from_email(id_)
-            metadata, annotations = self._extract_annotations_from_html(html)
+        for html, charset in self._fetch_html_in_background(id_list):
+            metadata, annotations = self._extract_annotations_from_html(html, charset)
             md = self.generate_markdown(metadata, annotations)
             fname = f"{metadata.title}-{metadata.author}-Notes.md"
             self.dump_markdown(md, fname)
@@ -214,23 +500,26 @@ class AnnotationExtractor:
         else:
             mode = "w"
         fname = sanitize(fname)
-        with open(fname, mode) as f:
-            if self.cfg.append_file: f.write("\n")
-            f.write(md)
+        # Encode once and write bytes, skipping the text layer of open()
+        data = md.encode("utf-8")
+        if self.cfg.append_file:
+            data = b"\n" + data
+        with open(fname, mode + "b", buffering=1 << 16) as f:
+            f.write(data)
         print(f"Annotations written in {fname}")
 
 
 import json
+# Lines whose first non-blank character is "#"
+_COMMENT_RE = re.compile(r"(?m)^[ \t]*#[^\n]*")
+
 def read_pseudo_json(filename):
     # The configuration is stored in a json file with comments
     # This is not standard json, so we have to filter-out the
     # comments
-    def is_comment(line):
-        return line.lstrip().startswith("#")
-
     try:
         with open(filename) as f:
-            data = "\n".join(line for line in f if not is_comment(line))
+            data = _COMMENT_RE.sub("", f.read())
             config = json.loads(data)
     except OSError:
         print("You must have a file named .get_annotations.cfg")
@@ -249,5 +538,5 @@ if __name__ == "__main__":
     config = read_pseudo_json(config_file)
     e_cfg= EmailConfig(**config.get("email"))
     cfg = Config(**config.get("options"))
-    extractor = AnnotationExtractor(e_cfg, cfg)
-    extractor.process_emails()
\ No newline at end of file
+    with AnnotationExtractor(e_cfg, cfg) as extractor:
+        extractor.process_emails()
\ No newline at end of file